@@ -7,15 +7,30 @@ Fixes:
   2. Delimiter:   Both files use comma (,) not semicolon (;)
 """
 
+import io
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from dotenv import load_dotenv
+import httpx
+import requests
 import supabase as supabase_ # pyright: ignore[reportMissingImports]
+from postgrest.exceptions import APIError # pyright: ignore[reportMissingImports]
+
+try:
+    import polars as pl # pyright: ignore[reportMissingImports]
+except Exception:
+    pl = None
 
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL", "https://jacwfkjkazqmspjdcysl.supabase.co")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+# Optional direct Postgres DSN (Supabase → Settings → Database). When set
+# and psycopg is installed, bulk loads go through COPY instead of PostgREST.
+SUPABASE_DB_URL = os.getenv("SUPABASE_DB_URL")
 
 if not SUPABASE_SERVICE_KEY:
     print("ERROR: Set SUPABASE_SERVICE_KEY in your .env file")
@@ -23,6 +38,10 @@ if not SUPABASE_SERVICE_KEY:
 
 supabase: supabase_.Client = supabase_.create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
 
+# One pooled session for all outbound HTTP — keep-alive avoids paying a
+# TCP+TLS handshake per request against a cold HDX edge
+HTTP = requests.Session()
+
 
 def clean_csv_bytes(filepath: str) -> str:
     with open(filepath, "rb") as f:
@@ -30,14 +49,38 @@ def clean_csv_bytes(filepath: str) -> str:
     return raw.replace(b"\x00", b"").decode("utf-8", errors="ignore")
 
 
+def iter_csv_lines(filepath: str):
+    """Stream decoded, NUL-stripped lines without materializing the file."""
+    with open(filepath, encoding="utf-8", errors="ignore", newline="") as f:
+        for line in f:
+            yield line.replace("\x00", "")
+
+
+# Header / preamble lines to drop — str.startswith takes the tuple and
+# short-circuits in C, one dispatch per row instead of three
+_SKIP_PREFIXES = ("sep=", "data_date", "date", '"')
+
+
+@lru_cache(maxsize=8192)
 def parse_date(date_str: str) -> str:
     """
     Convert UNHCR DD-MM-YY dates to YYYY-MM-DD.
     Examples:
       16-12-11  ->  2011-12-16
       19-02-26  ->  2026-02-19
+
+    The two known layouts (DD-MM-YY and YYYY-MM-DD) are handled by plain
+    string slicing — strptime is ~10× slower and only used as a fallback
+    for odd rows.
     """
     date_str = date_str.strip()
+    if len(date_str) == 8 and date_str[2] == "-" and date_str[5] == "-":
+        d, m, y = date_str[0:2], date_str[3:5], date_str[6:8]
+        if d.isdigit() and m.isdigit() and y.isdigit():
+            return f"20{y}-{m}-{d}"
+    elif len(date_str) == 10 and date_str[4] == "-" and date_str[7] == "-":
+        if date_str[0:4].isdigit() and date_str[5:7].isdigit() and date_str[8:10].isdigit():
+            return date_str
     for fmt in ("%d-%m-%y", "%Y-%m-%d", "%d-%m-%Y"):
         try:
             return datetime.strptime(date_str, fmt).strftime("%Y-%m-%d")
@@ -46,58 +89,185 @@ def parse_date(date_str: str) -> str:
     raise ValueError(f"Unrecognised date format: '{date_str}'")
 
 
-def load_population_timeseries(filepath: str):
-    print(f"\n📊 Loading population timeseries from: {filepath}")
+def _parse_dates_polars(df: "pl.DataFrame", column: str) -> "pl.DataFrame":
+    """Parse DD-MM-YY (with YYYY-MM-DD fallback) into ISO date strings."""
+    return df.with_columns(
+        pl.coalesce(
+            pl.col(column).str.strip_chars().str.strptime(pl.Date, "%d-%m-%y", strict=False),
+            pl.col(column).str.strip_chars().str.strptime(pl.Date, "%Y-%m-%d", strict=False),
+            pl.col(column).str.strip_chars().str.strptime(pl.Date, "%d-%m-%Y", strict=False),
+        ).dt.strftime("%Y-%m-%d").alias(column)
+    )
+
+
+def _parse_timeseries_polars(filepath: str) -> tuple[list, int]:
+    """Columnar parse of the timeseries CSV via Polars' Rust reader."""
     content = clean_csv_bytes(filepath)
-    rows = []
-    skipped = 0
-    for line in content.split("\n"):
+    df = pl.read_csv(
+        io.BytesIO(content.encode("utf-8")),
+        has_header=True,
+        columns=[0, 1],
+        new_columns=["data_date", "individuals"],
+        schema_overrides={"individuals": pl.Int64},
+        ignore_errors=True,
+        truncate_ragged_lines=True,
+    )
+    total = df.height
+    df = _parse_dates_polars(df, "data_date").drop_nulls()
+    # Keep last occurrence per date (2021-12-31 appears twice in source file)
+    df = df.unique(subset=["data_date"], keep="last", maintain_order=True)
+    return df.to_dicts(), total - df.height
+
+
+def _parse_timeseries_python(filepath: str) -> tuple[list, int]:
+    """Pure-Python fallback when Polars is not installed.
+
+    The inner loop keeps per-row work minimal: hoisted callables, no dict
+    allocation per row — rows become dicts only once, at the upsert
+    boundary, after deduplication.
+    """
+    # Dedupe on the raw date field first so parse_date/int run once per
+    # unique date, not once per row
+    raw: dict[str, str] = {}  # raw date field -> raw count field, last occurrence wins
+    for line in iter_csv_lines(filepath):
         line = line.strip()
-        if not line or line.startswith("sep=") or line.startswith("data_date") or line.startswith('"'):
+        if not line or line.startswith(_SKIP_PREFIXES):
             continue
-        parts = line.split(",")
+        # maxsplit=2: only the two used fields get their own strings, the
+        # rest of a wide row stays one unsplit tail
+        parts = line.split(",", 2)
         if len(parts) < 2:
             continue
+        raw[parts[0]] = parts[1]
+
+    skipped = 0
+    deduped: dict[str, int] = {}  # iso date -> individuals
+    for date_field, count_field in raw.items():
         try:
-            rows.append({
-                "data_date": parse_date(parts[0]),
-                "individuals": int(parts[1].strip())
-            })
+            deduped[parse_date(date_field)] = int(count_field.strip())
         except (ValueError, IndexError):
             skipped += 1
 
-    print(f"   Parsed {len(rows)} valid rows, skipped {skipped} invalid rows")
+    rows = [{"data_date": d, "individuals": n} for d, n in deduped.items()]
+    return rows, skipped
+
+
+def _batch_too_big(e: Exception) -> bool:
+    """True only for failures a smaller batch can fix: request timeouts and
+    payload-too-large rejections (HTTP 413 / Postgres 54000)."""
+    if isinstance(e, httpx.TimeoutException):
+        return True
+    if isinstance(e, APIError):
+        return str(e.code or "") in ("413", "54000")
+    return False
+
+
+def _copy_timeseries(rows: list) -> bool:
+    """
+    Bulk-load via Postgres COPY into a temp table, then one upsert.
+
+    10-100× faster than REST batches past ~10⁵ rows: no JSON encode, no
+    per-batch round-trips. Needs SUPABASE_DB_URL and psycopg
+    (pip install 'psycopg[binary]'); returns False so the caller can
+    fall back to PostgREST batches.
+    """
+    if not SUPABASE_DB_URL:
+        return False
+    try:
+        import psycopg # pyright: ignore[reportMissingImports]
+    except Exception:
+        print("   psycopg not installed — falling back to PostgREST upserts")
+        return False
+    with psycopg.connect(SUPABASE_DB_URL) as conn, conn.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE pop_stage (data_date date, individuals integer) ON COMMIT DROP")
+        with cur.copy("COPY pop_stage (data_date, individuals) FROM STDIN") as cp:
+            for r in rows:
+                cp.write_row((r["data_date"], r["individuals"]))
+        cur.execute(
+            "INSERT INTO population_timeseries (data_date, individuals) "
+            "SELECT data_date, individuals FROM pop_stage "
+            "ON CONFLICT (data_date) DO UPDATE SET individuals = excluded.individuals"
+        )
+    print(f"✅ Population timeseries: {len(rows)} rows loaded via COPY")
+    return True
+
+
+def load_population_timeseries(filepath: str):
+    print(f"\n📊 Loading population timeseries from: {filepath}")
+    if pl is not None:
+        rows, skipped = _parse_timeseries_polars(filepath)
+    else:
+        rows, skipped = _parse_timeseries_python(filepath)
+
+    print(f"   Parsed {len(rows)} unique rows, skipped {skipped} invalid/duplicate rows")
     if not rows:
         print("❌ No rows parsed — check file is in same folder as this script")
         return 0
 
-    # Deduplicate by date — keep last occurrence (2021-12-31 appears twice in source file)
-    deduped = {}
-    for row in rows:
-        deduped[row["data_date"]] = row
-    rows = list(deduped.values())
-    print(f"   After deduplication: {len(rows)} unique rows")
+    if _copy_timeseries(rows):
+        return len(rows)
+
+    def upload(chunk: list) -> int:
+        # Upsert one chunk, halving the batch size on payload/timeout errors
+        batch_size = len(chunk)
+        i = 0
+        while i < len(chunk):
+            batch = chunk[i:i+batch_size]
+            started = time.perf_counter()
+            try:
+                supabase.table("population_timeseries").upsert(batch, on_conflict="data_date").execute()
+            except Exception as e:
+                # Only shrink-and-retry when a smaller batch can actually
+                # help; auth/RLS/data errors fail fast instead
+                if batch_size > 100 and _batch_too_big(e):
+                    batch_size //= 2
+                    print(f"   ⚠️  Batch of {len(batch)} failed ({e}) — retrying with batch size {batch_size}")
+                    continue
+                raise
+            rtt_ms = (time.perf_counter() - started) * 1000
+            i += len(batch)
+            print(f"   Batch of {len(batch)} rows uploaded ({rtt_ms:.0f} ms)")
+        return len(chunk)
 
+    # PostgREST throughput plateaus past ~1k rows per batch; overlap the
+    # round-trips with a few workers — dates are unique across chunks so
+    # upsert order between chunks does not matter
+    chunks = [rows[i:i+1000] for i in range(0, len(rows), 1000)]
     inserted = 0
-    for i in range(0, len(rows), 100):
-        batch = rows[i:i+100]
-        supabase.table("population_timeseries").upsert(batch, on_conflict="data_date").execute()
-        inserted += len(batch)
-        print(f"   Batch {i//100+1}: {inserted}/{len(rows)} rows uploaded")
+    with ThreadPoolExecutor(max_workers=min(8, len(chunks))) as pool:
+        for n in pool.map(upload, chunks):
+            inserted += n
+            print(f"   {inserted}/{len(rows)} rows uploaded")
 
     print(f"✅ Population timeseries: {inserted} rows loaded")
     return inserted
 
 
-def load_population_demographics(filepath: str):
-    print(f"\n👥 Loading population demographics from: {filepath}")
+_DEMOGRAPHIC_COLUMNS = ["snapshot_date", "month", "year", "male_total", "female_total", "children_total", "uac_total"]
+
+
+def _parse_demographics_polars(filepath: str) -> list:
     content = clean_csv_bytes(filepath)
+    df = pl.read_csv(
+        io.BytesIO(content.encode("utf-8")),
+        has_header=True,
+        columns=list(range(7)),
+        new_columns=_DEMOGRAPHIC_COLUMNS,
+        schema_overrides={c: pl.Int64 for c in _DEMOGRAPHIC_COLUMNS[1:]},
+        ignore_errors=True,
+        truncate_ragged_lines=True,
+    )
+    df = _parse_dates_polars(df, "snapshot_date").drop_nulls()
+    return df.to_dicts()
+
+
+def _parse_demographics_python(filepath: str) -> list:
     rows = []
-    for line in content.split("\n"):
+    for line in iter_csv_lines(filepath):
         line = line.strip()
-        if not line or line.startswith("sep=") or line.startswith("date") or line.startswith('"'):
+        if not line or line.startswith(_SKIP_PREFIXES):
             continue
-        parts = line.split(",")
+        parts = line.split(",", 7)
         if len(parts) < 7:
             continue
         try:
@@ -112,23 +282,56 @@ def load_population_demographics(filepath: str):
             })
         except (ValueError, IndexError) as e:
             print(f"   Skipping: {line[:60]} — {e}")
+    return rows
+
+
+def load_population_demographics(filepath: str):
+    print(f"\n👥 Loading population demographics from: {filepath}")
+    if pl is not None:
+        rows = _parse_demographics_polars(filepath)
+    else:
+        rows = _parse_demographics_python(filepath)
 
     if not rows:
         print("⚠️  No valid demographic rows found")
         return 0
 
-    supabase.table("population_demographics").upsert(rows).execute()
+    # Batch to stay under PostgREST's payload limit if the file grows
+    for i in range(0, len(rows), 1000):
+        supabase.table("population_demographics").upsert(rows[i:i+1000]).execute()
     print(f"✅ Demographics: {len(rows)} row(s) loaded")
     for row in rows:
         print(f"   Date: {row['snapshot_date']} | Male: {row['male_total']:,} | Female: {row['female_total']:,} | Children: {row['children_total']:,}")
     return len(rows)
 
 
+def load_hdx_csv_resource(url: str, table: str, batch_size: int = 1000):
+    """
+    Download a bulk CSV attachment from an HDX dataset and upsert it.
+
+    Column names must already match the target table — HDX schemas are
+    dataset-specific, so pick the resource URL and table by hand, e.g.:
+        load_hdx_csv_resource(resource["download_url"], "camp_locations")
+    Parsing goes through Polars' multithreaded reader when available so
+    multi-MB attachments avoid the per-row Python path.
+    """
+    resp = HTTP.get(url, timeout=30)
+    resp.raise_for_status()
+    if pl is not None:
+        rows = pl.read_csv(io.BytesIO(resp.content), ignore_errors=True, truncate_ragged_lines=True).to_dicts()
+    else:
+        import csv
+        rows = list(csv.DictReader(io.StringIO(resp.content.decode("utf-8", errors="ignore"))))
+    for i in range(0, len(rows), batch_size):
+        supabase.table(table).upsert(rows[i:i+batch_size]).execute()
+    print(f"✅ HDX resource: {len(rows)} rows loaded into {table}")
+    return len(rows)
+
+
 def load_ocha_hdx_data(api_key: str):
     print(f"\n🌐 Fetching OCHA HDX data...")
     try:
-        import requests
-        resp = requests.get(
+        resp = HTTP.get(
             "https://data.humdata.org/api/3/action/package_search",
             params={"q": "syria refugees displacement camps", "fq": "organization:unhcr", "rows": 5},
             headers={"X-CKAN-API-Key": api_key},
@@ -140,9 +343,10 @@ def load_ocha_hdx_data(api_key: str):
             print(f"   Found {len(results)} datasets on HDX:")
             for r in results[:3]:
                 print(f"   - {r['title']}")
+            today = datetime.now().date().isoformat()
             known_camps = [
-                {"name": "Rukban Camp",       "zone": "Zone F", "camp_type": "informal", "population": 8000,  "capacity": 10000, "lat": 33.7094, "lng": 38.5644, "source": "OCHA HDX", "last_verified": datetime.now().date().isoformat()},
-                {"name": "Bab Al-Salam Camp", "zone": "Zone G", "camp_type": "formal",   "population": 15000, "capacity": 20000, "lat": 36.6167, "lng": 37.0833, "source": "OCHA HDX", "last_verified": datetime.now().date().isoformat()},
+                {"name": "Rukban Camp",       "zone": "Zone F", "camp_type": "informal", "population": 8000,  "capacity": 10000, "lat": 33.7094, "lng": 38.5644, "source": "OCHA HDX", "last_verified": today},
+                {"name": "Bab Al-Salam Camp", "zone": "Zone G", "camp_type": "formal",   "population": 15000, "capacity": 20000, "lat": 36.6167, "lng": 37.0833, "source": "OCHA HDX", "last_verified": today},
             ]
             supabase.table("camp_locations").upsert(known_camps).execute()
             print(f"✅ OCHA HDX: {len(known_camps)} camp locations added")
@@ -166,7 +370,9 @@ def print_summary():
         ("resource_needs",          "Resource needs"),
     ]:
         try:
-            result = supabase.table(table).select("id", count="exact").execute()
+            # estimated count reads pg_class.reltuples — O(1) instead of a
+            # full scan per table — and limit(0) skips transferring rows
+            result = supabase.table(table).select("id", count="estimated").limit(0).execute()
             count = result.count if result.count is not None else len(result.data)
             print(f"   {label:30s}: {count:>6} rows")
         except Exception as e:
@@ -3,13 +3,20 @@ main.py — Refugee Camp GIS Dashboard Backend
 FastAPI + Supabase (Python 3.11 + Pydantic v2 compatible)
 """
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from supabase import create_client, Client
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from supabase._async.client import AsyncClient, create_client as create_async_client
+from pydantic import BaseModel, ConfigDict
 from typing import Optional
+import httpx
+import orjson
 from datetime import date, datetime
+import asyncio
+import hashlib
 import os
+import time
 
 try:
     from dotenv import load_dotenv
@@ -24,196 +31,373 @@ SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_KEY") or os.environ.get("SUPABAS
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise RuntimeError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# The async client is created lazily on first use: serverless runs with
+# lifespan off, so there is no startup hook to build it in, and it must be
+# created on the running event loop anyway. Warm invocations reuse it.
+_db: Optional[AsyncClient] = None
+_db_lock = asyncio.Lock()
+
+async def get_db() -> AsyncClient:
+    global _db
+    if _db is None:
+        async with _db_lock:
+            if _db is None:
+                db = await create_async_client(SUPABASE_URL, SUPABASE_KEY)
+                # Rebuild the PostgREST session with an explicit keep-alive
+                # pool so repeat queries reuse warm connections instead of
+                # paying TCP+TLS setup.
+                session = db.postgrest.session
+                db.postgrest.session = httpx.AsyncClient(
+                    base_url=session.base_url,
+                    headers=session.headers,
+                    timeout=10,
+                    limits=httpx.Limits(max_keepalive_connections=20, max_connections=50, keepalive_expiry=30),
+                )
+                # Close the stock session we just replaced so its pool
+                # doesn't leak sockets on warm invocations.
+                await session.aclose()
+                _db = db
+    return _db
 
 # ── App ───────────────────────────────────────────────────────
-app = FastAPI(title="Refugee Camp GIS API", version="1.0.0")
+app = FastAPI(title="Refugee Camp GIS API", version="1.0.0", default_response_class=ORJSONResponse)
+
+# A fixed origin list lets the CORS middleware take its exact-match fast
+# path instead of wildcard handling. Set ALLOWED_ORIGINS to the deployed
+# frontend origin(s), comma-separated; the default stays open for local
+# development. Credentials are not allowed, so "*" remains spec-valid.
+ALLOWED_ORIGINS = [o.strip() for o in os.environ.get("ALLOWED_ORIGINS", "*").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=ALLOWED_ORIGINS,
+    allow_methods=["GET", "POST", "PUT"],
+    allow_headers=["content-type", "authorization"],
 )
 
+# Timeseries/camps/dashboard payloads run tens-to-hundreds of KB of JSON;
+# level 5 trades a little CPU for 3-10x smaller transfers. Sub-KB responses
+# skip compression entirely.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+# ── In-process TTL cache ─────────────────────────────────────
+# Dashboard reads vastly outnumber writes and the underlying data
+# changes on minute-to-hour timescales, so the hottest read endpoints
+# are served from a tiny per-key TTL store. Write endpoints clear it.
+_cache: dict = {}  # key -> (expires_at, value)
+_CACHE_MAX = 256  # hard cap so request-derived keys can't grow memory unbounded
+
+def cache_get(key: str):
+    entry = _cache.get(key)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+def cache_put(key: str, value, ttl: float = 30.0):
+    now = time.monotonic()
+    if len(_cache) >= _CACHE_MAX:
+        # sweep expired entries first; if the cache is still full, evict
+        # whatever expires soonest
+        for k in [k for k, entry in _cache.items() if entry[0] <= now]:
+            del _cache[k]
+        while len(_cache) >= _CACHE_MAX:
+            del _cache[min(_cache, key=lambda k: _cache[k][0])]
+    _cache[key] = (now + ttl, value)
+    return value
+
+def cache_clear():
+    _cache.clear()
+
+def _json_response(request: Request, body: bytes, etag: str, max_age: int, x_cache: Optional[str] = None) -> Response:
+    """Emit pre-serialized JSON with ETag + Cache-Control, or an empty 304
+    when the client's If-None-Match already holds the current ETag."""
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}, s-maxage={max_age}, stale-while-revalidate=300",
+    }
+    if x_cache:
+        headers["X-Cache"] = x_cache
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def conditional_json(request: Request, payload, max_age: int = 60) -> Response:
+    """Serialize once, let browsers and CDN edges short-circuit repeats."""
+    body = orjson.dumps(payload)
+    return _json_response(request, body, f'"{hashlib.md5(body).hexdigest()}"', max_age)
+
+def cached_response(request: Request, key: str, max_age: int = 60) -> Optional[Response]:
+    """Serve a cache hit straight from stored bytes — no re-aggregation,
+    no re-serialization; 304s resolve against the stored ETag."""
+    entry = cache_get(key)
+    if entry is None:
+        return None
+    body, etag = entry
+    return _json_response(request, body, etag, max_age, x_cache="HIT")
+
+def cache_response(request: Request, key: str, payload, ttl: float = 30.0, max_age: int = 60) -> Response:
+    """Serialize a fresh payload, store (bytes, etag) under the TTL, respond."""
+    body = orjson.dumps(payload)
+    etag = f'"{hashlib.md5(body).hexdigest()}"'
+    cache_put(key, (body, etag), ttl)
+    return _json_response(request, body, etag, max_age, x_cache="MISS")
+
 # ── Models (Pydantic v2 compatible) ──────────────────────────
+# extra="forbid" skips Pydantic's extra-field collection on these
+# per-request models and rejects typo'd payloads outright
 class AlertAcknowledge(BaseModel):
+    model_config = ConfigDict(extra="forbid")
     alert_id: int
     acknowledged_by: str
 
 class NewFlight(BaseModel):
+    model_config = ConfigDict(extra="forbid")
     flight_number: int
     area: str
     altitude_m: int = 120
     pilot_name: Optional[str] = None
 
 class TruckUpdate(BaseModel):
+    model_config = ConfigDict(extra="forbid")
     truck_id: str
     lat: float
     lng: float
     status: Optional[str] = None
     eta: Optional[str] = None
 
+class TruckBatchUpdate(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    updates: list[TruckUpdate]
+
 # ── Endpoints ─────────────────────────────────────────────────
 @app.get("/")
 def root():
     return {"api": "Refugee Camp GIS Dashboard", "version": "1.0.0", "status": "online", "docs": "/docs", "data_sources": ["UNHCR", "OCHA HDX"]}
 
 @app.get("/health")
-def health():
+async def health():
     try:
-        supabase.table("drone_flights").select("id").limit(1).execute()
+        supabase = await get_db()
+        await supabase.table("drone_flights").select("id").limit(1).execute()
         db = "connected"
     except Exception:
         db = "error"
-    return {"status": "ok", "database": db, "timestamp": datetime.now().isoformat()}
+    # orjson encodes datetimes natively — no isoformat() needed
+    return {"status": "ok", "database": db, "timestamp": datetime.now()}
 
 @app.get("/api/population/latest")
-def get_latest_population():
+async def get_latest_population(request: Request):
+    hit = cached_response(request, "population_latest", max_age=300)
+    if hit is not None:
+        return hit
     try:
-        ts   = supabase.table("population_timeseries").select("data_date, individuals").order("data_date", desc=True).limit(1).execute()
-        demo = supabase.table("population_demographics").select("*").order("snapshot_date", desc=True).limit(1).execute()
-        latest = ts.data[0] if ts.data else None
-        return {"latest_count": latest["individuals"] if latest else 0, "as_of_date": latest["data_date"] if latest else None, "demographics": demo.data[0] if demo.data else None, "source": "UNHCR"}
+        supabase = await get_db()
+        ts, demo = await asyncio.gather(
+            supabase.table("population_timeseries").select("data_date, individuals").order("data_date", desc=True).limit(1).maybe_single().execute(),
+            supabase.table("population_demographics").select("snapshot_date, month, year, male_total, female_total, children_total, uac_total").order("snapshot_date", desc=True).limit(1).maybe_single().execute(),
+        )
+        latest = ts.data if ts and ts.data else None
+        return cache_response(request, "population_latest", {"latest_count": latest["individuals"] if latest else 0, "as_of_date": latest["data_date"] if latest else None, "demographics": demo.data if demo and demo.data else None, "source": "UNHCR"}, ttl=300, max_age=300)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/population/trend")
-def get_population_trend(days: int = Query(30)):
+async def get_population_trend(days: int = Query(30)):
     try:
-        result = supabase.table("population_timeseries").select("data_date, individuals").order("data_date", desc=True).limit(days).execute()
-        return {"data": list(reversed(result.data)), "period_days": days}
+        supabase = await get_db()
+        result = await supabase.table("population_timeseries").select("data_date, individuals").order("data_date", desc=True).limit(days).execute()
+        return {"data": result.data[::-1], "period_days": days}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/population/timeseries")
-def get_timeseries(limit: int = Query(365)):
+async def get_timeseries(request: Request, limit: int = Query(365)):
     try:
-        result = supabase.table("population_timeseries").select("data_date, individuals").order("data_date").limit(limit).execute()
-        return {"count": len(result.data), "data": result.data}
+        supabase = await get_db()
+        result = await supabase.table("population_timeseries").select("data_date, individuals").order("data_date").limit(limit).execute()
+        return conditional_json(request, {"count": len(result.data), "data": result.data})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/camps")
-def get_camps(status: Optional[str] = None):
+async def get_camps(request: Request, status: Optional[str] = Query(None, pattern="^(active|closed|emergency)$")):
+    # status is validated against the known camp states above, so the
+    # cache key space stays bounded
+    cache_key = f"camps:{status}"
+    hit = cached_response(request, cache_key)
+    if hit is not None:
+        return hit
     try:
+        supabase = await get_db()
         q = supabase.table("camp_locations").select("id, name, zone, camp_type, population, capacity, lat, lng, status, source")
         if status:
             q = q.eq("status", status)
-        result = q.execute()
-        return {"count": len(result.data), "camps": result.data}
+        result = await q.execute()
+        return cache_response(request, cache_key, {"count": len(result.data), "camps": result.data}, ttl=60)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/camps/summary")
+async def get_camps_summary(request: Request):
+    hit = cached_response(request, "camps_summary")
+    if hit is not None:
+        return hit
+    try:
+        supabase = await get_db()
+        result = await supabase.rpc("camps_summary").execute()
+        row = result.data[0] if result.data else {"total_population": 0, "total_capacity": 0, "active_camps": 0, "total_camps": 0}
+        return cache_response(request, "camps_summary", row)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/detections/stats")
-def get_detection_stats(flight_id: Optional[str] = None):
-    try:
-        q = supabase.table("ai_detections").select("object_type")
-        if flight_id:
-            q = q.eq("flight_id", flight_id)
-        result = q.execute()
-        stats: dict = {}
-        for row in result.data:
-            t = row["object_type"]
-            stats[t] = stats.get(t, 0) + 1
-        return {"tents": stats.get("tent", 0), "latrines": stats.get("latrine", 0), "water_points": stats.get("water_point", 0), "total": len(result.data)}
+async def get_detection_stats(flight_id: Optional[str] = None):
+    try:
+        supabase = await get_db()
+        result = await supabase.rpc("detection_stats", {"p_flight_id": flight_id}).execute()
+        stats = {row["object_type"]: row["n"] for row in result.data}
+        return {"tents": stats.get("tent", 0), "latrines": stats.get("latrine", 0), "water_points": stats.get("water_point", 0), "total": sum(stats.values())}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/flights")
-def get_flights():
+async def get_flights(request: Request):
     try:
-        result = supabase.table("drone_flights").select("*").order("flight_date", desc=True).execute()
-        return {"flights": result.data}
+        supabase = await get_db()
+        result = await supabase.table("drone_flights").select("id, flight_number, area, altitude_m, status, coverage_pct, image_count, flight_date, pilot_name").order("flight_date", desc=True).execute()
+        return conditional_json(request, {"flights": result.data})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/flights")
-def create_flight(flight: NewFlight):
+async def create_flight(flight: NewFlight):
     try:
+        supabase = await get_db()
         data = {"id": f"flight-{flight.flight_number}", "flight_number": flight.flight_number, "area": flight.area, "altitude_m": flight.altitude_m, "status": "planned", "coverage_pct": 0, "image_count": 0, "flight_date": date.today().isoformat(), "pilot_name": flight.pilot_name}
-        result = supabase.table("drone_flights").insert(data).execute()
+        result = await supabase.table("drone_flights").insert(data).execute()
+        cache_clear()
         return {"success": True, "flight": result.data[0]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/trucks")
-def get_trucks():
+async def get_trucks():
     try:
-        result = supabase.table("trucks").select("*").execute()
+        supabase = await get_db()
+        result = await supabase.table("trucks").select("id, name, status, cargo, lat, lng, eta, updated_at").execute()
         return {"trucks": result.data}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/api/trucks/update")
-def update_truck(update: TruckUpdate):
+async def update_truck(update: TruckUpdate):
     try:
-        data: dict = {"lat": update.lat, "lng": update.lng, "updated_at": datetime.now().isoformat()}
+        supabase = await get_db()
+        # updated_at is set by the trucks_set_updated_at trigger
+        data: dict = {"lat": update.lat, "lng": update.lng}
         if update.status: data["status"] = update.status
         if update.eta:    data["eta"]    = update.eta
-        supabase.table("trucks").update(data).eq("id", update.truck_id).execute()
+        await supabase.table("trucks").update(data).eq("id", update.truck_id).execute()
+        cache_clear()
         return {"success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.put("/api/trucks/batch")
+async def update_trucks_batch(body: TruckBatchUpdate):
+    try:
+        supabase = await get_db()
+        # PostgREST bulk upsert needs uniform keys per request, so group
+        # rows by which optional fields they carry (usually one group)
+        groups: dict = {}
+        for u in body.updates:
+            row: dict = {"id": u.truck_id, "lat": u.lat, "lng": u.lng}
+            if u.status: row["status"] = u.status
+            if u.eta:    row["eta"]    = u.eta
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        await asyncio.gather(*(
+            supabase.table("trucks").upsert(rows, on_conflict="id").execute()
+            for rows in groups.values()
+        ))
+        cache_clear()
+        return {"success": True, "updated": len(body.updates)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/alerts")
-def get_alerts(include_acknowledged: bool = False):
+async def get_alerts(include_acknowledged: bool = False):
     try:
-        q = supabase.table("alerts").select("*").order("created_at", desc=True)
+        supabase = await get_db()
+        q = supabase.table("alerts").select("id, severity, zone, message, acknowledged, created_at").order("created_at", desc=True)
         if not include_acknowledged:
             q = q.eq("acknowledged", False)
-        result = q.execute()
+        result = await q.execute()
         return {"alerts": result.data}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/alerts/acknowledge")
-def acknowledge_alert(body: AlertAcknowledge):
+async def acknowledge_alert(body: AlertAcknowledge):
     try:
-        supabase.table("alerts").update({"acknowledged": True, "acknowledged_by": body.acknowledged_by, "acknowledged_at": datetime.now().isoformat()}).eq("id", body.alert_id).execute()
+        supabase = await get_db()
+        # acknowledged_at is set by the alerts_set_acknowledged_at trigger
+        await supabase.table("alerts").update({"acknowledged": True, "acknowledged_by": body.acknowledged_by}).eq("id", body.alert_id).execute()
+        cache_clear()
         return {"success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/resources/summary")
-def get_resources_summary():
-    try:
-        result = supabase.table("resource_needs").select("resource_type, need_pct").execute()
-        agg: dict = {}
-        for row in result.data:
-            rt = row["resource_type"]
-            if rt not in agg: agg[rt] = []
-            agg[rt].append(row["need_pct"])
-        return {"resources": {k: round(sum(v)/len(v), 1) for k, v in agg.items()}}
+async def get_resources_summary(request: Request):
+    hit = cached_response(request, "resources_summary")
+    if hit is not None:
+        return hit
+    try:
+        supabase = await get_db()
+        result = await supabase.table("resource_summary").select("resource_type, avg_need").execute()
+        return cache_response(request, "resources_summary", {"resources": {row["resource_type"]: row["avg_need"] for row in result.data}}, ttl=60)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/dashboard")
-def get_dashboard():
-    try:
-        pop     = supabase.table("population_timeseries").select("data_date, individuals").order("data_date", desc=True).limit(1).execute()
-        trend   = supabase.table("population_timeseries").select("data_date, individuals").order("data_date", desc=True).limit(7).execute()
-        trucks  = supabase.table("trucks").select("*").execute()
-        alerts  = supabase.table("alerts").select("*").eq("acknowledged", False).execute()
-        res     = supabase.table("resource_needs").select("resource_type, need_pct").execute()
-        flights = supabase.table("drone_flights").select("*").order("flight_date", desc=True).limit(5).execute()
-
-        agg: dict = {}
-        for row in res.data:
-            rt = row["resource_type"]
-            if rt not in agg: agg[rt] = []
-            agg[rt].append(row["need_pct"])
-        resource_avg = {k: round(sum(v)/len(v), 1) for k, v in agg.items()}
-
-        latest = pop.data[0] if pop.data else {"individuals": 234511, "data_date": None}
-        return {
-            "stats": {"total_population": latest["individuals"], "population_as_of": latest["data_date"], "tents": 1247, "latrines": 89, "water_points": 23, "aid_trucks": len(trucks.data), "last_update": datetime.now().strftime("%H:%M")},
-            "population_trend": list(reversed(trend.data)),
+async def get_dashboard(request: Request):
+    hit = cached_response(request, "dashboard")
+    if hit is not None:
+        return hit
+    try:
+        supabase = await get_db()
+        # The queries are independent — overlap the round-trips so latency
+        # is max(RTT) instead of sum(RTT). The 7-row trend window also
+        # supplies the latest reading (its first row), so population is
+        # fetched once.
+        trend, trucks, alerts, res, flights, dets = await asyncio.gather(
+            supabase.table("population_timeseries").select("data_date, individuals").order("data_date", desc=True).limit(7).execute(),
+            supabase.table("trucks").select("id, name, status, cargo, lat, lng, eta, updated_at").execute(),
+            supabase.table("alerts").select("id, severity, zone, message, acknowledged, created_at").eq("acknowledged", False).execute(),
+            supabase.table("resource_summary").select("resource_type, avg_need").execute(),
+            supabase.table("drone_flights").select("id, flight_number, area, altitude_m, status, coverage_pct, image_count, flight_date, pilot_name").order("flight_date", desc=True).limit(5).execute(),
+            supabase.rpc("detection_stats", {"p_flight_id": None}).execute(),
+        )
+
+        resource_avg = {row["resource_type"]: row["avg_need"] for row in res.data}
+        # Real AI-detection counts; demo figures only when nothing is loaded
+        det_counts = {row["object_type"]: row["n"] for row in dets.data} if dets.data else {"tent": 1247, "latrine": 89, "water_point": 23}
+
+        latest = trend.data[0] if trend.data else {"individuals": 234511, "data_date": None}
+        return cache_response(request, "dashboard", {
+            "stats": {"total_population": latest["individuals"], "population_as_of": latest["data_date"], "tents": det_counts.get("tent", 0), "latrines": det_counts.get("latrine", 0), "water_points": det_counts.get("water_point", 0), "aid_trucks": len(trucks.data), "last_update": datetime.now().strftime("%H:%M")},
+            "population_trend": trend.data[::-1],
             "trucks":  trucks.data,
             "alerts":  alerts.data,
             "resource_needs": resource_avg,
             "flights": flights.data,
             "source":  "UNHCR + OCHA HDX + Supabase"
-        }
+        }, ttl=60)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+if __name__ == "__main__":
+    # Guard so running `python main.py` serves the app instead of
+    # re-importing it (render/vercel entrypoints import main:app directly)
+    import uvicorn
+    uvicorn.run("main:app", host="0.0.0.0", port=int(os.environ.get("PORT", 8000)))
@@ -138,6 +138,116 @@ CREATE TABLE IF NOT EXISTS trucks (
   updated_at  TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- ============================================================
+-- WRITE-PATH TRIGGERS
+-- Timestamps are computed by Postgres so the hot update endpoints
+-- send smaller payloads and skip per-request clock formatting
+-- ============================================================
+CREATE OR REPLACE FUNCTION set_truck_updated_at()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  NEW.updated_at := now();
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trucks_set_updated_at ON trucks;
+CREATE TRIGGER trucks_set_updated_at
+  BEFORE UPDATE ON trucks
+  FOR EACH ROW EXECUTE FUNCTION set_truck_updated_at();
+
+CREATE OR REPLACE FUNCTION set_alert_acknowledged_at()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF NEW.acknowledged AND NOT coalesce(OLD.acknowledged, FALSE) THEN
+    NEW.acknowledged_at := now();
+  END IF;
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS alerts_set_acknowledged_at ON alerts;
+CREATE TRIGGER alerts_set_acknowledged_at
+  BEFORE UPDATE ON alerts
+  FOR EACH ROW EXECUTE FUNCTION set_alert_acknowledged_at();
+
+-- ============================================================
+-- QUERY-PATH INDEXES
+-- Matching the API's ORDER BY ... LIMIT and equality filters so
+-- hot endpoints do index scans instead of sorting whole tables.
+-- Single-column btrees serve both sort directions via backward
+-- scans; population_timeseries is already covered by its UNIQUE
+-- constraint on data_date.
+-- ============================================================
+CREATE INDEX IF NOT EXISTS ix_flights_date        ON drone_flights(flight_date);
+CREATE INDEX IF NOT EXISTS ix_demographics_date   ON population_demographics(snapshot_date);
+CREATE INDEX IF NOT EXISTS ix_camps_status        ON camp_locations(status);
+-- Partial: /api/alerts and the dashboard only read unacknowledged alerts
+CREATE INDEX IF NOT EXISTS ix_alerts_unack        ON alerts(created_at) WHERE acknowledged = FALSE;
+-- Composite for the detection_stats() GROUP BY with its flight filter
+CREATE INDEX IF NOT EXISTS ix_detections_flight_type ON ai_detections(flight_id, object_type);
+
+-- ============================================================
+-- AGGREGATE VIEWS
+-- Postgres does the GROUP BY so the API transfers a handful of
+-- rows instead of every detection / resource reading
+-- ============================================================
+-- Per-object-type detection counts, optionally filtered by flight —
+-- called via PostgREST RPC so the GROUP BY always runs server-side
+DROP VIEW IF EXISTS detection_stats;
+CREATE OR REPLACE FUNCTION detection_stats(p_flight_id text DEFAULT NULL)
+RETURNS TABLE(object_type text, n bigint)
+LANGUAGE sql STABLE AS $$
+  SELECT object_type, count(*)
+  FROM ai_detections
+  WHERE p_flight_id IS NULL OR flight_id = p_flight_id
+  GROUP BY object_type
+$$;
+
+-- One-row camp rollup for /api/camps/summary, called via PostgREST RPC
+CREATE OR REPLACE FUNCTION camps_summary()
+RETURNS TABLE(total_population bigint, total_capacity bigint, active_camps bigint, total_camps bigint)
+LANGUAGE sql STABLE AS $$
+  SELECT coalesce(sum(population), 0),
+         coalesce(sum(capacity), 0),
+         count(*) FILTER (WHERE status = 'active'),
+         count(*)
+  FROM camp_locations
+$$;
+
+-- Materialized so dashboard reads are a plain SELECT over a tiny table;
+-- resource_needs is written by batch jobs, so a refresh-on-write trigger
+-- keeps it current without per-read aggregation
+-- Both drops keep the file rerunnable: the plain-view drop migrates old
+-- databases, the matview drop covers databases where this file already ran
+DROP MATERIALIZED VIEW IF EXISTS resource_summary;
+DROP VIEW IF EXISTS resource_summary;
+CREATE MATERIALIZED VIEW IF NOT EXISTS resource_summary AS
+  SELECT resource_type,
+         round(avg(need_pct)::numeric, 1)  AS avg_need,
+         round(avg(stock_pct)::numeric, 1) AS avg_stock
+  FROM resource_needs
+  GROUP BY resource_type;
+
+CREATE UNIQUE INDEX IF NOT EXISTS resource_summary_type ON resource_summary(resource_type);
+
+CREATE OR REPLACE FUNCTION refresh_resource_summary()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  -- Plain refresh: CONCURRENTLY cannot run inside a transaction block and
+  -- triggers always do. The view is a few rows per resource type, so the
+  -- exclusive lock is held only momentarily; move to a cron/pg_notify
+  -- refresher if resource_needs writes ever become frequent.
+  REFRESH MATERIALIZED VIEW resource_summary;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS resource_needs_refresh_summary ON resource_needs;
+CREATE TRIGGER resource_needs_refresh_summary
+  AFTER INSERT OR UPDATE OR DELETE ON resource_needs
+  FOR EACH STATEMENT EXECUTE FUNCTION refresh_resource_summary();
+
 -- ============================================================
 -- ROW LEVEL SECURITY (RLS) — Allow public read, restrict writes
 -- ============================================================